@@ -1,19 +1,148 @@
-from flask import Flask, request, render_template, jsonify, send_from_directory
+from flask import Flask, request, render_template, jsonify, send_from_directory, abort, Response
+from werkzeug.security import safe_join
 import os
+import sys
+import shutil
+import itertools
+import threading
+import time
 from datetime import datetime
-import base64
+from urllib.parse import quote
+from tempfile import SpooledTemporaryFile
+
+# 优先使用SIMD加速的pybase64解码，未安装时回退到标准库
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# 优先使用orjson序列化JSON响应，直接生成bytes，未安装时回退到jsonify
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 
-# 设置图片保存目录
-UPLOAD_FOLDER = 'uploads'
+# 设置图片保存目录：图片只是临时数据，默认保存到内存文件系统/dev/shm，
+# 避免频繁的小文件写入和文件系统日志磨损SSD
+_DEFAULT_UPLOAD_FOLDER = '/dev/shm/esp_liveview' if os.path.isdir('/dev/shm') else 'uploads'
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', _DEFAULT_UPLOAD_FOLDER)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# 最新图片的文件名和时间戳
-latest_image = {
-    'filename': None,
-    'timestamp': None
-}
+# 超过该时间(秒)仍存在的临时文件视为残留（如worker在写入和替换之间被强制结束），会被删除
+STALE_TEMP_AGE = 60
+# 后台清理上传目录的间隔(秒)
+SWEEP_INTERVAL = 30
+
+# 部署在nginx之后时设置该前缀（如/internal/images/），图片由nginx通过sendfile直接发送
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+
+# 请求体即为原始JPEG数据的Content-Type
+RAW_IMAGE_MIMETYPES = ('application/octet-stream', 'image/jpeg')
+
+# 只保留最新的一张图片：上传先写入临时文件，再用os.replace原子替换latest.jpg，
+# 读取方不会看到写了一半的图片，目录中也不会堆积旧图片；
+# 多个worker共享同一个文件，无需在进程间同步最新图片信息
+LATEST_FILENAME = 'latest.jpg'
+LATEST_FILEPATH = os.path.join(UPLOAD_FOLDER, LATEST_FILENAME)
+
+# 进程内递增序号，与进程号一起保证并发上传的临时文件不会重名
+_temp_seq = itertools.count()
+
+def new_temp_path(filepath):
+    """为filepath生成唯一的临时文件路径，写完后再原子替换为filepath"""
+    return f"{filepath}.{os.getpid()}.{next(_temp_seq)}.tmp"
+
+def format_timestamp(mtime):
+    """将文件修改时间格式化为接口返回的时间戳字符串"""
+    return datetime.fromtimestamp(mtime).strftime("%Y%m%d_%H%M%S")
+
+def json_response(data, status=200):
+    """构建JSON响应"""
+    if orjson is not None:
+        return Response(orjson.dumps(data), status=status, mimetype='application/json')
+    return jsonify(data), status
+
+def write_image_file(filepath, data):
+    """将完整的图片数据一次性写入文件，不做fsync（图片数据无需持久化保证）"""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    fd = os.open(filepath, flags, 0o644)
+    try:
+        view = memoryview(data)
+        # 通常一次write即可写完，短写时继续写剩余部分
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def save_uploaded_file(image_file, filepath):
+    """保存multipart上传的文件
+
+    较大的上传会被Werkzeug缓存到磁盘临时文件中，Linux下用sendfile在内核中
+    直接复制到目标文件；缓存在内存中的小文件则一次读出并写入。
+    """
+    src = image_file.stream
+    # SpooledTemporaryFile.fileno()会把内存中的数据先转存到磁盘，
+    # 因此只取已落盘的底层文件，内存中的BytesIO没有文件描述符。
+    # _file是私有属性（在CPython 3.11.7、Werkzeug 3.1.9/Flask 3.1.3下确认），
+    # 取不到时回退到write_image_file
+    if isinstance(src, SpooledTemporaryFile):
+        raw = getattr(src, '_file', None)
+    else:
+        raw = src
+    try:
+        in_fd = raw.fileno()
+    except (AttributeError, OSError):
+        in_fd = None
+    
+    # 只有Linux的sendfile支持写入普通文件
+    if in_fd is None or not sys.platform.startswith('linux'):
+        write_image_file(filepath, src.read())
+        return
+    
+    offset = src.tell()
+    count = os.fstat(in_fd).st_size - offset
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    out_fd = os.open(filepath, flags, 0o644)
+    try:
+        while count > 0:
+            sent = os.sendfile(out_fd, in_fd, offset, count)
+            if sent == 0:
+                break
+            offset += sent
+            count -= sent
+    finally:
+        os.close(out_fd)
+
+def sweep_upload_folder():
+    """清理一次上传目录：删除残留的临时文件"""
+    deadline = time.time() - STALE_TEMP_AGE
+    for entry in os.scandir(UPLOAD_FOLDER):
+        if not entry.name.endswith('.tmp'):
+            continue
+        try:
+            if entry.stat().st_mtime < deadline:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            # 临时文件已被原子替换，或已被删除
+            pass
+
+def _sweep_upload_folder_forever():
+    while True:
+        try:
+            sweep_upload_folder()
+        except OSError as e:
+            print(f"清理上传目录失败: {e}", file=sys.stderr)
+        time.sleep(SWEEP_INTERVAL)
+
+def start_upload_sweeper():
+    """启动后台清理线程，启动时立即清理一次，之后定期清理
+
+    每个部署只需启动一个：Gunicorn在master进程的when_ready钩子中调用，
+    而不是每个worker各启动一个。
+    """
+    threading.Thread(target=_sweep_upload_folder_forever, daemon=True).start()
 
 @app.route('/')
 def index():
@@ -23,72 +152,98 @@ def index():
 @app.route('/upload', methods=['POST'])
 def upload_image():
     """处理来自ESP32S3的图片上传"""
+    temp_path = new_temp_path(LATEST_FILEPATH)
     try:
+        if request.mimetype in RAW_IMAGE_MIMETYPES:
+            # 处理原始二进制上传（推荐ESP32S3使用）：请求体即JPEG数据，
+            # 无需multipart解析和Base64解码
+            # 直接将请求体流式写入文件，不在内存中缓存整个图片；
+            # 分块传输编码的请求没有Content-Length，因此写完后再检查是否为空
+            with open(temp_path, "wb") as f:
+                shutil.copyfileobj(request.stream, f)
+                size = f.tell()
+            if size == 0:
+                return json_response({'error': 'No image data found'}, 400)
+        
         # 检查请求中是否有图片数据
-        if 'image' not in request.files and 'image' not in request.form:
-            return jsonify({'error': 'No image data found'}), 400
+        elif 'image' not in request.files and 'image' not in request.form:
+            return json_response({'error': 'No image data found'}, 400)
         
-        if 'image' in request.files:
-            # 处理二进制图片上传
-            image_file = request.files['image']
-            if image_file.filename == '':
-                return jsonify({'error': 'No image selected'}), 400
+        elif 'image' in request.files:
+            # 处理二进制图片上传：服务器只保留最新的一张图片，
+            # 一个请求中包含多个image字段时拒绝，而不是静默丢弃其余部分
+            image_files = request.files.getlist('image')
+            if len(image_files) > 1:
+                return json_response({'error': 'Only one image per request is supported'}, 400)
             
-            # 生成带时间戳的文件名
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"image_{timestamp}.jpg"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            image_file = image_files[0]
+            if image_file.filename == '':
+                return json_response({'error': 'No image selected'}, 400)
             
-            # 保存图片
-            image_file.save(filepath)
+            # 保存图片，避免save()的分块复制循环
+            save_uploaded_file(image_file, temp_path)
         else:
-            # 处理Base64编码的图片
+            # 处理Base64编码的图片（已弃用，仅为兼容旧客户端保留，
+            # 新客户端请使用application/octet-stream原始二进制上传）
             image_data = request.form['image']
             
-            # 检查是否有Base64前缀，如果有则去除
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-                
-            # 生成带时间戳的文件名
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"image_{timestamp}.jpg"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            # 检查是否有Base64前缀（如data:image/jpeg;base64,），如果有则去除
+            image_data = image_data.partition(',')[2] or image_data
             
             # 解码Base64并保存图片
-            with open(filepath, "wb") as f:
-                f.write(base64.b64decode(image_data))
+            write_image_file(temp_path, base64.b64decode(image_data, validate=False))
         
-        # 更新最新图片信息
-        latest_image['filename'] = filename
-        latest_image['timestamp'] = timestamp
+        # 原子替换最新图片
+        os.replace(temp_path, LATEST_FILEPATH)
         
-        return jsonify({
+        return json_response({
             'status': 'success',
-            'filename': filename,
-            'timestamp': timestamp
-        }), 200
+            'filename': LATEST_FILENAME,
+            'timestamp': format_timestamp(os.path.getmtime(LATEST_FILEPATH))
+        }, 200)
     
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
+    finally:
+        # 出错时删除未被替换的临时文件
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
 
 @app.route('/latest')
 def get_latest_image():
     """获取最新上传的图片信息"""
-    if latest_image['filename']:
-        return jsonify({
-            'filename': latest_image['filename'],
-            'timestamp': latest_image['timestamp'],
-            'url': f"/images/{latest_image['filename']}"
-        })
-    else:
-        return jsonify({'error': 'No image uploaded yet'}), 404
+    try:
+        mtime_ns = os.stat(LATEST_FILEPATH).st_mtime_ns
+    except FileNotFoundError:
+        return json_response({'error': 'No image uploaded yet'}, 404)
+    
+    # 图片URL固定不变，附带修改时间作为版本号，避免浏览器使用缓存的旧图片
+    return json_response({
+        'filename': LATEST_FILENAME,
+        'timestamp': format_timestamp(mtime_ns / 1e9),
+        'url': f"/images/{LATEST_FILENAME}?v={mtime_ns}"
+    })
 
 @app.route('/images/<filename>')
 def get_image(filename):
     """提供图片文件"""
+    if X_ACCEL_REDIRECT_PREFIX:
+        # 只返回响应头，由nginx零拷贝发送文件内容
+        filepath = safe_join(UPLOAD_FOLDER, filename)
+        if filepath is None or not os.path.isfile(filepath):
+            abort(404)
+        response = Response(mimetype='image/jpeg')
+        # nginx会对X-Accel-Redirect中的URI做解码，文件名需要先进行URL编码
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(filename)
+        return response
+    
+    # send_from_directory返回的文件响应会交给WSGI服务器的wsgi.file_wrapper，
+    # 在Gunicorn等服务器下由sendfile发送，无需经过Python读写循环
     return send_from_directory(UPLOAD_FOLDER, filename)
 
 if __name__ == '__main__':
-    # 在生产环境中，您应该使用适当的WSGI服务器如Gunicorn
-    # 这里使用Flask的开发服务器并监听所有网络接口
-    app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
+    # 在生产环境中，请使用Gunicorn启动: gunicorn -c gunicorn.conf.py app:app
+    # 这里使用Flask的开发服务器并监听所有网络接口；
+    # 热重载和调试器开销较大，仅在设置FLASK_DEBUG=1时启用
+    start_upload_sweeper()
+    app.run(host='0.0.0.0', port=5002, debug=os.environ.get('FLASK_DEBUG') == '1')
\ No newline at end of file
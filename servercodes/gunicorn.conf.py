@@ -0,0 +1,17 @@
+# Gunicorn生产环境配置
+# 启动命令: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = '0.0.0.0:5002'
+
+# 每个CPU核心一个worker进程，每个进程用线程池并发处理上传和轮询请求；
+# 最新图片通过原子替换UPLOAD_FOLDER/latest.jpg发布，各worker共享同一个文件，不依赖进程内状态
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = 8
+
+def when_ready(server):
+    """master进程启动完成后启动上传目录的清理线程：每个部署只运行一个，而不是每个worker各一个"""
+    from app import start_upload_sweeper
+    start_upload_sweeper()
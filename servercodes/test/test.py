@@ -5,13 +5,15 @@ ESP-LiveView 测试客户端
 
 功能：
 1. 上传本地图片到服务器（二进制文件方式）
-2. 上传本地图片到服务器（Base64编码方式）
-3. 获取最新上传的图片信息
-4. 下载并显示最新图片
-5. 模拟ESP32S3定时上传图片
+2. 上传本地图片到服务器（原始二进制请求体方式）
+3. 上传本地图片到服务器（Base64编码方式，已弃用）
+4. 获取最新上传的图片信息
+5. 下载并显示最新图片
+6. 模拟ESP32S3定时上传图片
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import base64
 import argparse
 import time
@@ -33,11 +35,17 @@ class ESPLiveViewClient:
         self.upload_url = f"{self.server_url}/upload"
         self.latest_url = f"{self.server_url}/latest"
         self.images_url = f"{self.server_url}/images"
+        
+        # 复用TCP连接，避免每次请求都重新握手
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
     def test_server_connection(self):
         """测试服务器连接"""
         try:
-            response = requests.get(self.server_url, timeout=5)
+            response = self.session.get(self.server_url, timeout=5)
             if response.status_code == 200:
                 print(f"✓ 服务器连接成功: {self.server_url}")
                 return True
@@ -58,7 +66,7 @@ class ESPLiveViewClient:
             print(f"正在上传图片: {image_path}")
             with open(image_path, 'rb') as f:
                 files = {'image': (os.path.basename(image_path), f, 'image/jpeg')}
-                response = requests.post(self.upload_url, files=files)
+                response = self.session.post(self.upload_url, files=files)
             
             if response.status_code == 200:
                 result = response.json()
@@ -75,8 +83,35 @@ class ESPLiveViewClient:
             print(f"✗ 上传过程中出错: {e}")
             return None
     
+    def upload_image_raw(self, image_path):
+        """使用原始二进制请求体上传方式（application/octet-stream）"""
+        if not os.path.exists(image_path):
+            print(f"✗ 文件不存在: {image_path}")
+            return None
+        
+        try:
+            print(f"正在以原始二进制方式上传图片: {image_path}")
+            with open(image_path, 'rb') as f:
+                headers = {'Content-Type': 'application/octet-stream'}
+                response = self.session.post(self.upload_url, data=f, headers=headers)
+            
+            if response.status_code == 200:
+                result = response.json()
+                print(f"✓ 原始二进制上传成功! 文件名: {result.get('filename')}")
+                return result
+            else:
+                print(f"✗ 原始二进制上传失败: HTTP {response.status_code}")
+                try:
+                    print(response.json())
+                except:
+                    print(response.text)
+                return None
+        except Exception as e:
+            print(f"✗ 原始二进制上传过程中出错: {e}")
+            return None
+    
     def upload_image_base64(self, image_path):
-        """使用Base64编码上传方式"""
+        """使用Base64编码上传方式（已弃用，请使用upload_image_raw）"""
         if not os.path.exists(image_path):
             print(f"✗ 文件不存在: {image_path}")
             return None
@@ -88,7 +123,7 @@ class ESPLiveViewClient:
                 base64_data = base64.b64encode(image_data).decode('utf-8')
             
             payload = {'image': base64_data}
-            response = requests.post(self.upload_url, data=payload)
+            response = self.session.post(self.upload_url, data=payload)
             
             if response.status_code == 200:
                 result = response.json()
@@ -109,7 +144,7 @@ class ESPLiveViewClient:
         """获取最新图片信息"""
         try:
             print("正在获取最新图片信息...")
-            response = requests.get(self.latest_url)
+            response = self.session.get(self.latest_url)
             
             if response.status_code == 200:
                 info = response.json()
@@ -138,7 +173,7 @@ class ESPLiveViewClient:
         
         try:
             print(f"正在下载图片: {image_url}")
-            response = requests.get(image_url)
+            response = self.session.get(image_url)
             
             if response.status_code == 200:
                 # 将图片保存到临时文件
@@ -171,11 +206,27 @@ class ESPLiveViewClient:
             print(f"✗ 文件不存在: {image_path}")
             return False
         
+        # 只读取一次图片，每次以原始二进制请求体上传
+        with open(image_path, 'rb') as f:
+            image_data = f.read()
+        # 不区分图片格式，统一作为原始二进制数据上传
+        headers = {'Content-Type': 'application/octet-stream'}
+        
         print(f"模拟ESP32S3，每{interval}秒上传一次图片，共{count}次")
         for i in range(count):
             print(f"\n[{i+1}/{count}] 上传周期开始")
-            result = self.upload_image_binary(image_path)
-            if result:
+            try:
+                response = self.session.post(self.upload_url, data=image_data, headers=headers)
+                # 只检查状态码，不解析响应内容
+                response.close()
+                success = response.status_code == 200
+                if not success:
+                    print(f"✗ 上传失败: HTTP {response.status_code}")
+            except requests.exceptions.RequestException as e:
+                print(f"✗ 上传过程中出错: {e}")
+                success = False
+            
+            if success:
                 print(f"上传完成，等待{interval}秒...")
                 if i < count - 1:  # 最后一次不需要等待
                     time.sleep(interval)
@@ -189,7 +240,7 @@ class ESPLiveViewClient:
 def main():
     parser = argparse.ArgumentParser(description='ESP-LiveView 测试客户端')
     parser.add_argument('--server', default='http://localhost:5000', help='服务器URL')
-    parser.add_argument('--mode', choices=['upload', 'upload-base64', 'get-latest', 'download', 'simulate'], 
+    parser.add_argument('--mode', choices=['upload', 'upload-raw', 'upload-base64', 'get-latest', 'download', 'simulate'], 
                        default='upload', help='操作模式')
     parser.add_argument('--image', help='要上传的图片路径')
     parser.add_argument('--interval', type=int, default=10, help='模拟ESP32S3上传间隔(秒)')
@@ -210,6 +261,12 @@ def main():
             sys.exit(1)
         client.upload_image_binary(args.image)
     
+    elif args.mode == 'upload-raw':
+        if not args.image:
+            print("错误: 原始二进制上传模式需要指定图片路径 (--image)")
+            sys.exit(1)
+        client.upload_image_raw(args.image)
+    
     elif args.mode == 'upload-base64':
         if not args.image:
             print("错误: Base64上传模式需要指定图片路径 (--image)")
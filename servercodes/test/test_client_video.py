@@ -11,18 +11,26 @@ ESP-LiveView 视频测试客户端
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
 import time
-import os
 import sys
 import cv2
-import tempfile
+import numpy as np
 from datetime import datetime
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm  # 进度条库
 
+# 优先使用libjpeg-turbo的SIMD JPEG编码（pip install PyTurboJPEG），未安装时回退到OpenCV
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:
+    TurboJPEG = None
+
 class VideoFrameUploader:
-    def __init__(self, server_url):
+    def __init__(self, server_url, workers=4, max_width=None):
         """初始化上传器"""
         self.server_url = server_url
         # 去除URL末尾的斜杠（如果有）
@@ -31,16 +39,37 @@ class VideoFrameUploader:
         
         self.upload_url = f"{self.server_url}/upload"
         
+        # 复用TCP连接，避免每次请求都重新握手
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # JPEG编码器，找不到libturbojpeg动态库时也回退到OpenCV
+        self.tj = None
+        if TurboJPEG is not None:
+            try:
+                self.tj = TurboJPEG()
+            except Exception:
+                self.tj = None
+        
+        # 并行编码JPEG的线程数（上传始终由单个线程按顺序进行）
+        self.workers = workers
+        # 帧的最大宽度，超过时在编码前等比缩小（None表示不缩放）
+        self.max_width = max_width
+        
         # 状态变量
         self.running = False
         self.frames_total = 0
         self.frames_uploaded = 0
         self.upload_errors = 0
+        # 解码线程和上传线程共享计数器和进度条，需要加锁
+        self.stats_lock = threading.Lock()
     
     def test_server_connection(self):
         """测试服务器连接"""
         try:
-            response = requests.get(self.server_url, timeout=5)
+            response = self.session.get(self.server_url, timeout=5)
             if response.status_code == 200:
                 print(f"✓ 服务器连接成功: {self.server_url}")
                 return True
@@ -51,34 +80,87 @@ class VideoFrameUploader:
             print(f"✗ 无法连接到服务器: {e}")
             return False
     
+    def encode_frame(self, frame):
+        """在内存中将帧编码为JPEG，失败时返回None"""
+        # 编码前缩小过宽的帧，同时减少编码耗时和传输数据量
+        h, w = frame.shape[:2]
+        if self.max_width and w > self.max_width:
+            frame = cv2.resize(frame, (self.max_width, h * self.max_width // w),
+                               interpolation=cv2.INTER_AREA)
+        
+        if self.tj is not None:
+            return self.tj.encode(frame, quality=85, pixel_format=TJPF_BGR)
+        
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        return buf.tobytes() if ok else None
+    
     def upload_frame(self, frame):
         """上传单帧图像到服务器"""
-        # 创建临时文件保存帧
-        fd, temp_path = tempfile.mkstemp(suffix='.jpg')
+        # 在内存中将帧编码为JPEG，无需写入临时文件
         try:
-            # 保存帧为JPEG
-            cv2.imwrite(temp_path, frame)
+            data = self.encode_frame(frame)
+        except Exception:
+            data = None
+        return self.upload_jpeg(data)
+    
+    def upload_jpeg(self, data):
+        """上传已编码的JPEG数据，data为None表示编码失败"""
+        try:
+            if data is None:
+                with self.stats_lock:
+                    self.upload_errors += 1
+                return False
             
-            # 上传到服务器
-            with open(temp_path, 'rb') as f:
-                files = {'image': ('frame.jpg', f, 'image/jpeg')}
-                response = requests.post(self.upload_url, files=files)
+            # 上传到服务器：直接以原始二进制作为请求体，省去multipart编码
+            response = self.session.post(self.upload_url, data=data,
+                                         headers={'Content-Type': 'image/jpeg'})
             
-            # 检查响应
+            # 只检查状态码，不解析响应内容；立即释放连接回连接池
+            response.close()
             if response.status_code == 200:
-                self.frames_uploaded += 1
+                with self.stats_lock:
+                    self.frames_uploaded += 1
                 return True
             else:
-                self.upload_errors += 1
+                with self.stats_lock:
+                    self.upload_errors += 1
                 return False
                 
         except Exception as e:
-            self.upload_errors += 1
+            with self.stats_lock:
+                self.upload_errors += 1
             return False
-        finally:
-            # 删除临时文件
-            os.close(fd)
-            os.unlink(temp_path)
+    
+    def _upload_worker(self, frame_queue, progress_bar):
+        """上传线程：按解码顺序取出编码结果并上传，直到收到结束标记None
+
+        服务器只保留最新的一帧，因此只用一个线程按顺序上传，
+        避免并发请求乱序到达导致实时画面回退。
+        """
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            
+            # 已停止时只消费队列，不再上传
+            if not self.running:
+                continue
+            
+            timestamp, future = item
+            try:
+                data = future.result()
+            except Exception:
+                data = None
+            self.upload_jpeg(data)
+            
+            # 更新进度条
+            with self.stats_lock:
+                progress_bar.update(1)
+                progress_bar.set_postfix({
+                    "成功": self.frames_uploaded,
+                    "错误": self.upload_errors,
+                    "时间点": f"{timestamp:.2f}s"
+                })
     
     def process_video(self, video_path, interval=1.0, realtime=True):
         """
@@ -106,15 +188,11 @@ class VideoFrameUploader:
         print(f"- 总帧数: {frame_count}")
         print(f"- 时长: {duration:.2f} 秒")
         
-        # 计算要提取的帧
-        frames_to_extract = []
-        current_time = 0
-        
-        while current_time < duration:
-            frame_number = int(current_time * fps)
-            if frame_number < frame_count:
-                frames_to_extract.append((frame_number, current_time))
-            current_time += interval
+        # 计算要提取的帧：用NumPy向量运算一次算出所有时间点和对应的帧号
+        timestamps = np.arange(0, duration, interval)
+        frame_numbers = (timestamps * fps).astype(np.int64)
+        mask = frame_numbers < frame_count
+        frames_to_extract = list(zip(frame_numbers[mask].tolist(), timestamps[mask].tolist()))
         
         self.frames_total = len(frames_to_extract)
         print(f"将上传 {self.frames_total} 帧图像，间隔 {interval} 秒")
@@ -127,41 +205,60 @@ class VideoFrameUploader:
         # 创建进度条
         progress_bar = tqdm(total=self.frames_total, desc="上传进度", unit="帧")
         
-        # 开始提取和上传
+        # 开始提取和上传：当前线程负责解码，线程池并行编码JPEG，
+        # 单个上传线程按顺序上传，网络等待与后续帧的解码和编码重叠进行
         start_time = time.time()
+        frame_queue = queue.Queue(maxsize=8)
+        encode_pool = ThreadPoolExecutor(max_workers=self.workers)
+        uploader = threading.Thread(target=self._upload_worker, args=(frame_queue, progress_bar))
+        uploader.start()
         
-        for i, (frame_number, timestamp) in enumerate(frames_to_extract):
-            if not self.running:
-                break
+        # 下一次grab()将读到的帧号
+        position = 0
+        
+        try:
+            for i, (frame_number, timestamp) in enumerate(frames_to_extract):
+                if not self.running:
+                    break
+                    
+                # 顺序前进到目标帧：FFmpeg后端的grab()仍会完整解码每一帧
+                # （后续帧依赖前面的参考帧），只是跳过YUV→BGR颜色转换；
+                # 顺序读取避免了按帧号seek时反复从关键帧重新解码
+                ret = True
+                while ret and position <= frame_number:
+                    ret = cap.grab()
+                    position += 1
                 
-            # 设置视频位置
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            ret, frame = cap.read()
-            
-            if not ret:
-                print(f"✗ 无法读取帧 {frame_number}")
-                self.upload_errors += 1
-                continue
-            
-            # 上传帧
-            upload_success = self.upload_frame(frame)
-            
-            # 更新进度条
-            progress_bar.update(1)
-            progress_bar.set_postfix({
-                "成功": self.frames_uploaded,
-                "错误": self.upload_errors,
-                "时间点": f"{timestamp:.2f}s"
-            })
-            
-            # 如果是实时模式，等待适当的时间
-            if realtime and i < len(frames_to_extract) - 1:
-                next_timestamp = frames_to_extract[i + 1][1]
-                elapsed = time.time() - start_time
-                wait_time = max(0, (next_timestamp - timestamp) - (elapsed - timestamp))
+                # 只对需要上传的帧做颜色转换并取出图像
+                if ret:
+                    ret, frame = cap.retrieve()
                 
-                if wait_time > 0:
-                    time.sleep(wait_time)
+                if not ret:
+                    print(f"✗ 无法读取帧 {frame_number}")
+                    with self.stats_lock:
+                        self.upload_errors += 1
+                    continue
+                
+                # 提交编码任务，并按解码顺序交给上传线程
+                # （队列满时阻塞，限制内存中待上传的帧数）
+                frame_queue.put((timestamp, encode_pool.submit(self.encode_frame, frame)))
+                
+                # 如果是实时模式，等待到下一帧的绝对截止时间，
+                # 单帧处理的抖动只消耗余量，不会累积成漂移
+                if realtime and i < len(frames_to_extract) - 1:
+                    next_timestamp = frames_to_extract[i + 1][1]
+                    sleep_for = start_time + next_timestamp - time.time()
+                    
+                    if sleep_for > 0:
+                        time.sleep(sleep_for)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            # 通知上传线程结束，并等待正在进行的编码和上传完成
+            frame_queue.put(None)
+            uploader.join()
+            encode_pool.shutdown(wait=True)
         
         # 关闭进度条
         progress_bar.close()
@@ -182,18 +279,31 @@ class VideoFrameUploader:
         """停止上传过程"""
         self.running = False
 
+def positive_int(value):
+    """argparse类型检查：只接受正整数"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必须是正整数: {value}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(description='ESP-LiveView 视频测试客户端')
     parser.add_argument('--server', default='http://localhost:5002', help='服务器URL')
     parser.add_argument('--video', required=True, help='视频文件路径')
     parser.add_argument('--interval', type=float, default=1.0, help='上传帧的时间间隔(秒)')
     parser.add_argument('--realtime', action='store_true', help='以视频实际速度上传')
+    parser.add_argument('--workers', type=positive_int, default=4, help='并行编码JPEG的线程数(上传始终按顺序进行)')
+    parser.add_argument('--max-width', type=positive_int, default=None, help='上传帧的最大宽度(像素)，超过时等比缩小')
     parser.add_argument('--accelerate', type=float, default=1.0, help='加速倍数 (仅当--realtime未指定时有效)')
     
     args = parser.parse_args()
     
     # 初始化上传器
-    uploader = VideoFrameUploader(args.server)
+    uploader = VideoFrameUploader(
+        args.server,
+        workers=args.workers,
+        max_width=args.max_width
+    )
     
     # 测试服务器连接
     if not uploader.test_server_connection():